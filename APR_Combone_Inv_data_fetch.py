@@ -1,37 +1,51 @@
 import os
-import json
-import base64
+import sys
+import orjson
 import requests
-import pandas as pd
 import gspread
 import pytz
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
+from operator import itemgetter
+from gsheets import get_worksheet, sheet_text
+from odoo import (
+    compile_extractor,
+    PAGE_TIMEOUT,
+    fetch_pages_in_order,
+    iter_rpc_records,
+    restore_session,
+    save_session,
+    session_cache_path,
+    with_retries,
+)
 
 # --------- Environment Variables ---------
 ODOO_URL = os.getenv("ODOO_URL")
 ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("ODOO_USERNAME")
 ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
-GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
+ODOO_SESSION_CACHE = session_cache_path("apr_combine_invoice")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "1V0x5_DJn6bC1xzyMeBglzSeH-eDIWtKG4E5Cv3rwA_I")
 SHEET_TAB_NAME = os.getenv("SHEET_TAB_NAME", "04_CI_DF")
 
-# --------- Setup Google Credentials ---------
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+FETCH_WORKERS = 8  # concurrent Odoo page requests
 
 session = requests.Session()
-session.headers.update({"Content-Type": "application/json"})
+session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+
+
+# --------- Cached Odoo Session ---------
+def _session_owner():
+    return {"url": ODOO_URL, "db": ODOO_DB, "login": ODOO_USERNAME}
 
 
 # --------- Login to Odoo ---------
 def odoo_login():
+    cached = restore_session(session, ODOO_URL, ODOO_SESSION_CACHE, _session_owner())
+    if cached:
+        print(f"✅ Reusing cached Odoo session! UID: {cached['uid']}")
+        return cached["uid"]
+
     url = f"{ODOO_URL}/web/session/authenticate"
     payload = {
         "jsonrpc": "2.0",
@@ -39,63 +53,51 @@ def odoo_login():
         "params": {"db": ODOO_DB, "login": ODOO_USERNAME, "password": ODOO_PASSWORD},
         "id": 1,
     }
-    resp = session.post(url, data=json.dumps(payload))
+    resp = session.post(url, data=orjson.dumps(payload))
     resp.raise_for_status()
-    uid = resp.json()["result"]["uid"]
+    uid = orjson.loads(resp.content)["result"]["uid"]
     print(f"✅ Logged in! UID: {uid}")
+    save_session(session, ODOO_SESSION_CACHE, _session_owner())
     return uid
 
 
-# --------- Helper for safely extracting string values ---------
-def get_string_value(field, subfield=None):
-    if isinstance(field, dict):
-        if subfield:
-            value = field.get(subfield)
-            return get_string_value(value)
-        if "display_name" in field:
-            return str(field["display_name"] or "")
-        return " ".join([str(v) for v in field.values()])
-    elif isinstance(field, int):
-        return str(field)
-    elif field in (False, None):
-        return ""
-    return str(field)
+# --------- Fetch Combine Invoice Lines ---------
+INVOICE_SPECIFICATION = {
+    "sale_order_line": {"fields": {"order_id": {"fields": {"display_name": {}}}}},
+    "invoice_id": {"fields": {"display_name": {}, "lc_no": {}, "lc_date": {}, "invoice_payment_term_id": {}}},
+    "buying_house": {"fields": {"display_name": {}}},
+    "product_uom_category_id": {"fields": {"display_name": {}}},
+    "company_id": {"fields": {"display_name": {}}},
+    "invoice_date": {},
+    "parent_state": {},
+    "quantity": {},
+    "price_total": {},
+    "fg_categ_type": {},
+    # A relational field without sub-fields comes back as its bare id
+    "sales_ots_line": {},
+    "marketing_ots_line": {},
+    "buyer_id": {"fields": {"display_name": {}}},
+    "buyer_group": {"fields": {"display_name": {}}},
+    "customer_id": {"fields": {"display_name": {}}},
+    "customer_group": {"fields": {"display_name": {}}},
+    "sales_person": {"fields": {"display_name": {}}},
+    "team_id": {"fields": {"display_name": {}}},
+    "country_id": {"fields": {"display_name": {}}},
+}
 
 
-# --------- Fetch Combine Invoice Lines ---------
-def fetch_invoice_lines(uid, start_date="2025-04-01", end_date="2025-04-30", batch_size=2000):
-    all_records = []
-    offset = 0
+def fetch_invoice_lines(uid, start_date="2025-04-01", end_date="2025-04-30", batch_size=2000, max_workers=FETCH_WORKERS):
+    total = 0
 
     domain = ["&", ["parent_state", "=", "posted"], "&", "&",
               ["invoice_date", ">=", start_date],
               ["invoice_date", "<=", end_date],
               ["parent_state", "=", "posted"]]
 
-    specification = {
-        "sale_order_line": {"fields": {"order_id": {"fields": {"display_name": {}}}}},
-        "invoice_id": {"fields": {"display_name": {}, "lc_no": {}, "lc_date": {}, "invoice_payment_term_id": {}}},
-        "buying_house": {"fields": {"display_name": {}}},
-        "product_uom_category_id": {"fields": {"display_name": {}}},
-        "company_id": {"fields": {"display_name": {}}},
-        "invoice_date": {},
-        "parent_state": {},
-        "quantity": {},
-        "price_total": {},
-        "fg_categ_type": {},
-        "sales_ots_line": {"fields": {"id": {}}},
-        "marketing_ots_line": {"fields": {"id": {}}},
-        "buyer_id": {"fields": {"display_name": {}}},
-        "buyer_group": {"fields": {"display_name": {}}},
-        "customer_id": {"fields": {"display_name": {}}},
-        "customer_group": {"fields": {"display_name": {}}},
-        "sales_person": {"fields": {"display_name": {}}},
-        "team_id": {"fields": {"display_name": {}}},
-        "country_id": {"fields": {"display_name": {}}},
-    }
+    url = f"{ODOO_URL}/web/dataset/call_kw/combine.invoice.line/web_search_read"
 
-    while True:
-        payload = {
+    def build_payload(offset, limit, fields):
+        return {
             "jsonrpc": "2.0",
             "method": "call",
             "params": {
@@ -104,101 +106,179 @@ def fetch_invoice_lines(uid, start_date="2025-04-01", end_date="2025-04-30", bat
                 "args": [],
                 "kwargs": {
                     "domain": domain,
-                    "specification": specification,
+                    "specification": fields,
                     "offset": offset,
-                    "limit": batch_size,
+                    "limit": limit,
                     "order": "",
                     "context": {
                         "lang": "en_US",
                         "tz": "Asia/Dhaka",
                         "uid": uid,
                         "allowed_company_ids": [1, 3],
-                        "bin_size": True,
                         "current_company_id": 1,
                     },
-                    "count_limit": 100000,
                 },
             },
             "id": 3,
         }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/combine.invoice.line/web_search_read",
-                            data=json.dumps(payload))
+
+    def fetch_count():
+        resp = session.post(url, data=orjson.dumps(build_payload(0, 1, {"id": {}})))
         resp.raise_for_status()
-        result = resp.json()["result"]
-        records = result.get("records", [])
-        all_records.extend(records)
-        print(f"Fetched {len(records)} records, total so far: {len(all_records)}")
-        if len(records) < batch_size:
-            break
-        offset += batch_size
-
-    print(f"✅ Finished. Total fetched: {len(all_records)}")
-    return all_records
-
-
-# --------- Flatten Records ---------
-def flatten_invoice_records(records):
-    return [{
-        "Sale Order Ref": get_string_value(r.get("sale_order_line"), "order_id"),
-        "Customer Invoice Items": get_string_value(r.get("invoice_id")),
-        "Buying House": get_string_value(r.get("buying_house")),
-        "Category": get_string_value(r.get("product_uom_category_id")),
-        "Company": get_string_value(r.get("company_id")),
-        "Invoice Date": get_string_value(r.get("invoice_date")),
-        "Status": get_string_value(r.get("parent_state")),
-        "Quantity": r.get("quantity", 0),
-        "Total": r.get("price_total", 0),
-        "Item": get_string_value(r.get("fg_categ_type")),
-        "Sales Ots Line ID": get_string_value(r.get("sales_ots_line"), "id"),
-        "Marketing Ots Line ID": get_string_value(r.get("marketing_ots_line"), "id"),
-        "LC No": get_string_value(r.get("invoice_id"), "lc_no"),
-        "LC Date": get_string_value(r.get("invoice_id"), "lc_date"),
-        "Payment Terms": get_string_value(r.get("invoice_id"), "invoice_payment_term_id"),
-        "Buyer": get_string_value(r.get("buyer_id")),
-        "Buyer Group": get_string_value(r.get("buyer_group")),
-        "Customer": get_string_value(r.get("customer_id")),
-        "Customer Group": get_string_value(r.get("customer_group")),
-        "Sales Person": get_string_value(r.get("sales_person")),
-        "Team": get_string_value(r.get("team_id")),
-        "Country": get_string_value(r.get("country_id")),
-    } for r in records]
-
-
-# --------- Normalize Dates & Group ---------
-def normalize_dates_and_group(df: pd.DataFrame):
-    # Convert datetime64[ns] columns to just date (drop time component)
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
-
-    # Separate numeric and non-numeric columns
-    numeric_cols = df.select_dtypes(include="number").columns.tolist()
-    group_cols = [c for c in df.columns if c not in numeric_cols]
-
-    # Group and sum numeric columns
-    return df.groupby(group_cols, dropna=False)[numeric_cols].sum().reset_index()
+        return orjson.loads(resp.content)
+
+    # Read the total up front so every page offset is known and can be fetched in parallel
+    count_data = with_retries(fetch_count)()
+    if "error" in count_data:
+        raise RuntimeError(count_data["error"]["data"]["message"])
+    total_count = count_data["result"]["length"]
+    print(f"🔎 Total records to fetch: {total_count}")
+
+    def fetch_page(offset):
+        with session.post(url, data=orjson.dumps(build_payload(offset, batch_size, INVOICE_SPECIFICATION)), stream=True, timeout=PAGE_TIMEOUT) as resp:
+            resp.raise_for_status()
+            return list(iter_rpc_records(resp))
+
+    seen_ids = set()
+    for records in fetch_pages_in_order(with_retries(fetch_page), range(0, total_count, batch_size), max_workers):
+        total += len(records)
+        print(f"Fetched {len(records)} records, total so far: {total}/{total_count}")
+        # Offset pages can overlap when rows are added mid-fetch; keep the first copy of each id
+        yield from (r for r in records if r["id"] not in seen_ids and not seen_ids.add(r["id"]))
+
+    print(f"✅ Finished. Total fetched: {total}")
+
+
+# --------- Flatten & Group Records ---------
+# Sheet column -> (Odoo field, subfield). Quantity/Total are copied as numbers.
+INVOICE_COLUMNS = [
+    ("Sale Order Ref", "sale_order_line", "order_id"),
+    ("Customer Invoice Items", "invoice_id", None),
+    ("Buying House", "buying_house", None),
+    ("Category", "product_uom_category_id", None),
+    ("Company", "company_id", None),
+    ("Invoice Date", "invoice_date", None),
+    ("Status", "parent_state", None),
+    ("Quantity", "quantity", None),
+    ("Total", "price_total", None),
+    ("Item", "fg_categ_type", None),
+    ("Sales Ots Line ID", "sales_ots_line", None),
+    ("Marketing Ots Line ID", "marketing_ots_line", None),
+    ("LC No", "invoice_id", "lc_no"),
+    ("LC Date", "invoice_id", "lc_date"),
+    ("Payment Terms", "invoice_id", "invoice_payment_term_id"),
+    ("Buyer", "buyer_id", None),
+    ("Buyer Group", "buyer_group", None),
+    ("Customer", "customer_id", None),
+    ("Customer Group", "customer_group", None),
+    ("Sales Person", "sales_person", None),
+    ("Team", "team_id", None),
+    ("Country", "country_id", None),
+]
+NUMERIC_COLUMNS = ["Quantity", "Total"]
+GROUP_COLUMNS = [name for name, _, _ in INVOICE_COLUMNS if name not in NUMERIC_COLUMNS]
 
+# Columns with a handful of distinct values; interned so equal keys share one str
+LOW_CARDINALITY_COLUMNS = {
+    "Buying House", "Category", "Company", "Invoice Date", "Status", "Item", "Payment Terms",
+    "Buyer", "Buyer Group", "Customer", "Customer Group", "Sales Person", "Team", "Country",
+}
+
+def get_number_value(field):
+    return float(field or 0)
+
+
+def interned(extract):
+    """Wrap a string extractor so repeated values share a single str object."""
+    def extract_interned(field):
+        return sys.intern(extract(field))
+    return extract_interned
+
+
+def _column_extractor(name, field, subfield):
+    if name in NUMERIC_COLUMNS:
+        return get_number_value
+    extract = compile_extractor(INVOICE_SPECIFICATION[field], subfield)
+    return interned(extract) if name in LOW_CARDINALITY_COLUMNS else extract
+
+
+# One extractor per column, resolved once instead of per cell
+INVOICE_EXTRACTORS = {name: _column_extractor(name, field, subfield) for name, field, subfield in INVOICE_COLUMNS}
+
+# Each Odoo field is read once per record even when several columns derive from it
+# (e.g. invoice_id). web_search_read returns every field of the specification, so
+# one itemgetter call pulls the whole row out of the record dict in C.
+INVOICE_FIELDS = list(dict.fromkeys(field for _, field, _ in INVOICE_COLUMNS))
+get_invoice_fields = itemgetter(*INVOICE_FIELDS)
+
+
+def group_invoice_records(records):
+    """
+    Flatten and group the (streamed) records in a single pass: each record's
+    group key is built straight from its fields and its Quantity/Total are
+    added to that group's running sums, so only one row per distinct group is
+    ever held instead of a full per-line frame. Returns the grouped sheet rows
+    (GROUP_COLUMNS then NUMERIC_COLUMNS) ready to upload.
+    """
+    # The schema is fixed, so resolve every column to (row position, extractor) once
+    key_plan = [(INVOICE_FIELDS.index(field), INVOICE_EXTRACTORS[name])
+                for name, field, _ in INVOICE_COLUMNS if name in GROUP_COLUMNS]
+    sum_plan = [(INVOICE_FIELDS.index(field), INVOICE_EXTRACTORS[name])
+                for name, field, _ in INVOICE_COLUMNS if name in NUMERIC_COLUMNS]
+    sums = {}
+    for r in records:
+        row = get_invoice_fields(r)
+        key = tuple([extract(row[i]) for i, extract in key_plan])
+        acc = sums.get(key)
+        if acc is None:
+            acc = sums[key] = [0.0] * len(sum_plan)
+        for j, (i, extract) in enumerate(sum_plan):
+            acc[j] += extract(row[i])
+
+    # Key tuples sort column by column, giving the rows in group-column order
+    return [[*key, *acc] for key, acc in sorted(sums.items())]
 
 
 # --------- Paste to Google Sheet ---------
-def paste_to_gsheet(df):
-    worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_TAB_NAME)
-    if df.empty:
-        print(f"⚠️ Skip: {SHEET_TAB_NAME} DataFrame is empty.")
+def write_rows(worksheet, values, extra_ranges=(), chunk_rows=10000, max_workers=4):
+    """
+    Write ``values`` from A1 as parallel ``chunk_rows``-row updates; ``extra_ranges``
+    (e.g. the timestamp cell) go out in the same request as the last chunk.
+    """
+    if worksheet.row_count < len(values):
+        worksheet.add_rows(len(values) - worksheet.row_count)
+    last_start = (len(values) - 1) // chunk_rows * chunk_rows
+
+    def write_chunk(start):
+        chunk = values[start:start + chunk_rows]
+        end_cell = gspread.utils.rowcol_to_a1(start + len(chunk), len(values[0]))
+        data = [{"range": f"A{start + 1}:{end_cell}", "values": chunk}]
+        if start == last_start:
+            data.extend(extra_ranges)
+        worksheet.batch_update(data, value_input_option="USER_ENTERED")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(write_chunk, range(0, len(values), chunk_rows)))
+
+
+def paste_to_gsheet(rows):
+    worksheet = get_worksheet(GOOGLE_SHEET_ID, SHEET_TAB_NAME)
+    if not rows:
+        print(f"⚠️ Skip: {SHEET_TAB_NAME} has no rows.")
         return
     worksheet.batch_clear(["A:V"])
-    set_with_dataframe(worksheet, df, include_index=False, include_column_header=True)
+    # Group columns are text, escaped the way dataframe_values does; the sums stay numbers
+    n_text = len(GROUP_COLUMNS)
+    values = [GROUP_COLUMNS + NUMERIC_COLUMNS] + [[*map(sheet_text, row[:n_text]), *row[n_text:]] for row in rows]
 
     local_tz = pytz.timezone("Asia/Dhaka")
     local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-    worksheet.update("W1", [[f"Last Updated: {local_time}"]])
+    write_rows(worksheet, values, extra_ranges=[{"range": "W1", "values": [[f"Last Updated: {local_time}"]]}])
     print(f"✅ Data pasted to Google Sheet ({SHEET_TAB_NAME}), timestamp: {local_time}")
 
 
 if __name__ == "__main__":
     uid = odoo_login()
     records = fetch_invoice_lines(uid)
-    flat_rows = flatten_invoice_records(records)
-    df = pd.DataFrame(flat_rows)
-    grouped_df = normalize_dates_and_group(df)
-    paste_to_gsheet(grouped_df)
+    rows = group_invoice_records(records)
+    paste_to_gsheet(rows)
@@ -1,23 +1,26 @@
 import os
+import io
 import json
 import re
 import time
-import base64
+import orjson
 import requests
 import pandas as pd
 import gspread
 import pytz
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from gsheets import dataframe_values, get_worksheet
+from odoo import drop_session, restore_session, save_session, session_cache_path
 
 # ================== CONFIG ==================
 ODOO_URL = os.getenv("ODOO_URL")
 DB = os.getenv("ODOO_DB")
 USERNAME = os.getenv("ODOO_USERNAME")
 PASSWORD = os.getenv("ODOO_PASSWORD")
+ODOO_SESSION_CACHE = session_cache_path("ar_report")
 
-GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "1sPVTbTppdEn7_S2hFyYGTF2pUoyOx19NM4siqbCKFCw")
 SHEET_TAB_NAME = os.getenv("SHEET_TAB_NAME", "Raw_Data")
 
@@ -25,53 +28,132 @@ MODEL = "ppc.report"
 REPORT_BUTTON_METHOD = "action_generate_xlsx_report"
 REPORT_TYPE = "report_all_invocie"
 ALLOWED_COMPANY_IDS = [1, 3]
+# (connect, read) seconds: fail fast on a dead host. Login, /web and the wizard
+# calls answer quickly; generating and downloading the report can take minutes
+REQUEST_TIMEOUT = (5, 60)
+REPORT_TIMEOUT = (5, 300)
+# JSON-RPC bodies are serialised with orjson, so the content type is set per call
+JSON_HEADERS = {"Content-Type": "application/json"}
+# Matched against the raw /web body, so the page is never decoded to text
+CSRF_TOKEN_RE = re.compile(rb'var odoo = {\s*csrf_token: "([A-Za-z0-9]+)"')
 
 # ================== DYNAMIC DATES ==================
 today = datetime.now().date()
 DATE_FROM = today.replace(day=1).strftime("%Y-%m-%d")
 DATE_TO = today.strftime("%Y-%m-%d")
 
-# ================== GOOGLE SHEET SETUP ==================
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64).decode("utf-8"))
-creds = Credentials.from_service_account_info(creds_json, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-gc = gspread.authorize(creds)
-
+# ================== GOOGLE SHEET ==================
 def paste_to_gsheet(df):
-    worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_TAB_NAME)
+    worksheet = get_worksheet(GOOGLE_SHEET_ID, SHEET_TAB_NAME)
     if df.empty:
         print(f"⚠️ Skip: {SHEET_TAB_NAME} DataFrame is empty.")
         return
     worksheet.batch_clear(["A:BM"])
-    set_with_dataframe(worksheet, df, include_index=False, include_column_header=True)
+    values = dataframe_values(df)
+    if worksheet.row_count < len(values):
+        worksheet.add_rows(len(values) - worksheet.row_count)
 
     local_tz = pytz.timezone("Asia/Dhaka")
     local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-    worksheet.update("BN1", [[f"Last Updated: {local_time}"]])
+    # Rows and timestamp go out together in a single values.batchUpdate request
+    end_cell = gspread.utils.rowcol_to_a1(len(values), len(df.columns))
+    worksheet.batch_update(
+        [
+            {"range": f"A1:{end_cell}", "values": values},
+            {"range": "BN1", "values": [[f"Last Updated: {local_time}"]]},
+        ],
+        value_input_option="USER_ENTERED",
+    )
     print(f"✅ Data pasted to Google Sheet ({SHEET_TAB_NAME}), timestamp: {local_time}")
 
+class TransientError(Exception):
+    """A failed step that is worth running the whole fetch again for."""
+
+
+def is_transient(exc):
+    """True for network trouble, connect timeouts, 429 and 5xx replies; anything else will fail the same way again."""
+    if isinstance(exc, TransientError):
+        return True
+    if isinstance(exc, requests.ReadTimeout):
+        # Odoo is still working on the request (typically rendering the report); a rerun would only queue it again
+        return False
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else None
+        return status is None or status == 429 or status >= 500
+    if isinstance(exc, gspread.exceptions.APIError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # A garbled or HTML (proxy error page) reply where JSON was expected
+    return isinstance(exc, (requests.RequestException, orjson.JSONDecodeError))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to requests made without one."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+# ================== CACHED ODOO SESSION ==================
+def _session_owner():
+    return {"url": ODOO_URL, "db": DB, "login": USERNAME}
+
+
 # ================== ODOO FETCH LOGIC ==================
 def run_odoo_fetch():
     session = requests.Session()
     session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"})
+    # All steps hit the same host, so they share one kept-alive connection; gateway
+    # errors are retried here with backoff, and the last response is handed back
+    # to the raise_for_status checks below if they persist. A read timeout is never
+    # retried: the POST may already be running server-side (e.g. report generation)
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=False,
+        status=3,
+        backoff_factor=1,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(max_retries=retry, timeout=REQUEST_TIMEOUT)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
 
-    # Step 1: Login
-    login_url = f"{ODOO_URL}/web/session/authenticate"
-    login_payload = {"jsonrpc": "2.0","params":{"db": DB,"login": USERNAME,"password": PASSWORD}}
-    resp = session.post(login_url, json=login_payload)
-    resp.raise_for_status()
-    login_result = resp.json()
-    uid = login_result.get("result", {}).get("uid")
-    if not uid:
-        raise Exception(f"❌ Login failed: {resp.text}")
-    print("✅ Logged in, UID =", uid)
-
-    # Step 2: Get CSRF token
-    resp = session.get(f"{ODOO_URL}/web")
-    match = re.search(r'var odoo = {\s*csrf_token: "([A-Za-z0-9]+)"', resp.text)
-    csrf_token = match.group(1) if match else None
+    # Step 1: Login, unless the cached session is still live
+    cached = restore_session(session, ODOO_URL, ODOO_SESSION_CACHE, _session_owner()) or {}
+    uid, csrf_token = cached.get("uid"), cached.get("csrf_token")
+    if uid:
+        print("✅ Reusing cached Odoo session, UID =", uid)
+    else:
+        login_url = f"{ODOO_URL}/web/session/authenticate"
+        login_payload = {"jsonrpc": "2.0","params":{"db": DB,"login": USERNAME,"password": PASSWORD}}
+        resp = session.post(login_url, data=orjson.dumps(login_payload), headers=JSON_HEADERS)
+        resp.raise_for_status()
+        login_result = orjson.loads(resp.content)
+        uid = login_result.get("result", {}).get("uid")
+        if not uid:
+            raise Exception(f"❌ Login failed: {resp.text}")
+        print("✅ Logged in, UID =", uid)
+
+    # Step 2: Get CSRF token (bound to the session, so a cached one stays valid with it)
     if not csrf_token:
-        raise Exception("❌ Failed to extract CSRF token")
-    print("✅ CSRF token =", csrf_token)
+        resp = session.get(f"{ODOO_URL}/web")
+        match = CSRF_TOKEN_RE.search(resp.content)
+        csrf_token = match.group(1).decode("ascii") if match else None
+        if not csrf_token:
+            raise TransientError("❌ Failed to extract CSRF token")
+        print("✅ CSRF token =", csrf_token)
+        save_session(session, ODOO_SESSION_CACHE, _session_owner(), csrf_token=csrf_token)
+
+    # Same context for every call below, built once
+    context = {"lang": "en_US","tz": "Asia/Dhaka","uid": uid,"allowed_company_ids": ALLOWED_COMPANY_IDS}
 
     # Step 3: Onchange (fetch defaults)
     onchange_url = f"{ODOO_URL}/web/dataset/call_kw/{MODEL}/onchange"
@@ -87,10 +169,10 @@ def run_odoo_fetch():
                 "all_buyer_list": {"fields": {"display_name": {}}},
                 "all_Customer": {"fields": {"display_name": {}}}
             }],
-            "kwargs": {"context": {"lang": "en_US","tz": "Asia/Dhaka","uid": uid,"allowed_company_ids": ALLOWED_COMPANY_IDS}}
+            "kwargs": {"context": context}
         }
     }
-    resp = session.post(onchange_url, json=onchange_payload)
+    resp = session.post(onchange_url, data=orjson.dumps(onchange_payload), headers=JSON_HEADERS)
     resp.raise_for_status()
     print("✅ Onchange defaults received")
 
@@ -105,7 +187,7 @@ def run_odoo_fetch():
             "method": "web_save",
             "args": [[], {"report_type": REPORT_TYPE, "date_from": DATE_FROM, "date_to": DATE_TO, "all_buyer_list": [], "all_Customer": []}],
             "kwargs": {
-                "context": {"lang": "en_US","tz": "Asia/Dhaka","uid": uid,"allowed_company_ids": ALLOWED_COMPANY_IDS},
+                "context": context,
                 "specification": {
                     "report_type": {}, "date_from": {}, "date_to": {},
                     "all_buyer_list": {"fields": {"display_name": {}}},
@@ -114,9 +196,9 @@ def run_odoo_fetch():
             }
         }
     }
-    resp = session.post(web_save_url, json=web_save_payload)
+    resp = session.post(web_save_url, data=orjson.dumps(web_save_payload), headers=JSON_HEADERS)
     resp.raise_for_status()
-    wizard_id = resp.json().get("result", [{}])[0].get("id")
+    wizard_id = orjson.loads(resp.content).get("result", [{}])[0].get("id")
     if not wizard_id:
         raise Exception(f"❌ Wizard creation failed: {resp.text}")
     print("✅ Wizard saved, ID =", wizard_id)
@@ -131,12 +213,12 @@ def run_odoo_fetch():
             "model": MODEL,
             "method": REPORT_BUTTON_METHOD,
             "args": [[wizard_id]],
-            "kwargs": {"context": {"lang": "en_US","tz": "Asia/Dhaka","uid": uid,"allowed_company_ids": ALLOWED_COMPANY_IDS}}
+            "kwargs": {"context": context}
         }
     }
-    resp = session.post(call_button_url, json=call_button_payload)
+    resp = session.post(call_button_url, data=orjson.dumps(call_button_payload), headers=JSON_HEADERS, timeout=REPORT_TIMEOUT)
     resp.raise_for_status()
-    report_info = resp.json().get("result", {})
+    report_info = orjson.loads(resp.content).get("result", {})
     report_name = report_info.get("report_name")
     if not report_name:
         raise Exception(f"❌ Failed to generate report: {resp.text}")
@@ -145,35 +227,41 @@ def run_odoo_fetch():
     # Step 6: Download file with retries
     download_url = f"{ODOO_URL}/report/download"
     options = {"date_from": DATE_FROM, "date_to": DATE_TO}
-    context = {"lang": "en_US","tz": "Asia/Dhaka","uid": uid,"allowed_company_ids": ALLOWED_COMPANY_IDS}
     report_path = f"/report/xlsx/{report_name}/{wizard_id}?options={json.dumps(options)}&context={json.dumps(context)}"
     download_payload = {"data": json.dumps([report_path, "xlsx"]),"context": json.dumps(context),"token": "dummy","csrf_token": csrf_token}
     headers = {"X-CSRF-Token": csrf_token, "Referer": f"{ODOO_URL}/web"}
 
-    filename = f"All_Companies_{REPORT_TYPE}_{DATE_FROM}_to_{DATE_TO}.xlsx"
-    success = False
+    report = None
     for attempt in range(4):
         try:
-            resp = session.post(download_url, data=download_payload, headers=headers, timeout=60)
-            if resp.status_code == 200 and "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" in resp.headers.get("content-type", ""):
-                with open(filename, "wb") as f:
-                    f.write(resp.content)
-                print(f"✅ Report downloaded: {filename}")
-                success = True
-                break
-            else:
-                print(f"❌ Download attempt {attempt+1} failed", resp.status_code, resp.text[:500])
+            # Collect the body in memory and hand it straight to pandas; the file was never kept
+            with session.post(download_url, data=download_payload, headers=headers, stream=True, timeout=REPORT_TIMEOUT) as resp:
+                if resp.status_code == 200 and "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" in resp.headers.get("content-type", ""):
+                    buffer = io.BytesIO()
+                    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                        buffer.write(chunk)
+                    buffer.seek(0)
+                    report = buffer
+                    print(f"✅ Report downloaded: {report.getbuffer().nbytes} bytes")
+                    break
+                else:
+                    print(f"❌ Download attempt {attempt+1} failed", resp.status_code, resp.text[:500])
+        except requests.ReadTimeout:
+            # The report took longer than REPORT_TIMEOUT to render; asking again won't be faster
+            raise
         except Exception as e:
             print(f"❌ Download attempt {attempt+1} failed with exception: {e}")
         if attempt < 3:
             print("Retrying in 5 seconds...")
             time.sleep(5)
 
-    if not success:
-        raise Exception("❌ All download attempts failed")
+    if report is None:
+        # A stale cached CSRF token would fail every attempt; log in afresh on the next run
+        drop_session(ODOO_SESSION_CACHE)
+        raise TransientError("❌ All download attempts failed")
 
     # Step 7: Paste to Google Sheet
-    df = pd.read_excel(filename)
+    df = pd.read_excel(report, engine="calamine")
     paste_to_gsheet(df)
 
 if __name__ == "__main__":
@@ -188,6 +276,10 @@ if __name__ == "__main__":
         except Exception as e:
             retries += 1
             print(f"❌ Attempt {retries}/{MAX_RETRIES} failed: {e}")
+            if not is_transient(e):
+                # Bad credentials, access errors, unexpected replies: retrying won't help
+                print("⚠️ Not a transient failure, not retrying.")
+                raise
             if retries < MAX_RETRIES:
                 print("⏳ Retrying in 10 seconds...")
                 time.sleep(10)
@@ -1,13 +1,21 @@
 import os
-import json
-import base64
+import orjson
 import requests
 import pandas as pd
 import gspread
 import pytz
 from datetime import datetime
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
+from gsheets import dataframe_values, get_worksheet
+from odoo import (
+    compile_extractor,
+    PAGE_TIMEOUT,
+    fetch_pages_in_order,
+    iter_rpc_records,
+    restore_session,
+    save_session,
+    session_cache_path,
+    with_retries,
+)
 from dotenv import load_dotenv
 load_dotenv()
 # --------- Environment Variables ---------
@@ -15,24 +23,28 @@ ODOO_URL = os.getenv("ODOO_URL")
 ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("ODOO_USERNAME")
 ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
-GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
+ODOO_SESSION_CACHE = session_cache_path("ar_invoice_status")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "1sPVTbTppdEn7_S2hFyYGTF2pUoyOx19NM4siqbCKFCw")
 SHEET_TAB_NAME = os.getenv("SHEET_TAB_NAME", "Invoice Status_DF")  # change tab name if needed
 
-# --------- Setup Google Credentials ---------
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+FETCH_WORKERS = 8  # concurrent Odoo page requests
 
 session = requests.Session()
-session.headers.update({"Content-Type": "application/json"})
+session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip"})
+
+
+# --------- Cached Odoo Session ---------
+def _session_owner():
+    return {"url": ODOO_URL, "db": ODOO_DB, "login": ODOO_USERNAME}
 
 
 # --------- Odoo Login ---------
 def odoo_login():
+    cached = restore_session(session, ODOO_URL, ODOO_SESSION_CACHE, _session_owner())
+    if cached:
+        print(f"✅ Reusing cached Odoo session! UID: {cached['uid']}")
+        return cached["uid"]
+
     url = f"{ODOO_URL}/web/session/authenticate"
     payload = {
         "jsonrpc": "2.0",
@@ -40,61 +52,49 @@ def odoo_login():
         "params": {"db": ODOO_DB, "login": ODOO_USERNAME, "password": ODOO_PASSWORD},
         "id": 1,
     }
-    resp = session.post(url, data=json.dumps(payload))
+    resp = session.post(url, data=orjson.dumps(payload))
     resp.raise_for_status()
-    uid = resp.json()["result"]["uid"]
+    uid = orjson.loads(resp.content)["result"]["uid"]
     print(f"✅ Logged in! UID: {uid}")
+    save_session(session, ODOO_SESSION_CACHE, _session_owner())
     return uid
 
 
-# --------- Helper ---------
-def get_string_value(field, subfield=None):
-    if isinstance(field, dict):
-        if subfield:
-            return get_string_value(field.get(subfield))
-        if "display_name" in field:
-            return str(field["display_name"] or "")
-        return " ".join([str(v) for v in field.values()])
-    elif isinstance(field, int):
-        return str(field)
-    elif field in (False, None):
-        return ""
-    return str(field)
-
-
 # --------- Fetch combine.invoice ---------
-def fetch_combine_invoice(uid, batch_size=2000):
-    all_records = []
-    offset = 0
+# Specification based on your 'namelist'
+SUMMARY_SPECIFICATION = {
+    "name": {},
+    "acceptance_date": {},
+    "acceptance_status": {},
+    "finance_team_submitted_date": {},
+    "commercial_handover_date": {},
+    "delivery_date": {},
+    "commercial_doc_revd_date": {},
+    "docs_state": {},
+    "invoice_status": {"fields": {"display_name": {}}},
+    "oa_state": {},
+    "partner_id": {"fields": {"display_name": {}}},
+    "payment_maturity_date": {},
+    "payment_maturity_status": {},
+    "payment_recv_date": {},
+    "tentative_acceptance_date": {},
+    "tentative_payment_maturity_date": {},
+    "amount_total": {},
+    "due_amt": {},
+    "total_recv_amt":{}
+}
+
+
+def fetch_combine_invoice(uid, batch_size=2000, max_workers=FETCH_WORKERS):
+    total = 0
 
     # Odoo search domain — empty to fetch all
     domain = []
 
-    # Specification based on your 'namelist'
-    specification = {
-        "name": {},
-        "acceptance_date": {},
-        "acceptance_status": {},
-        "finance_team_submitted_date": {},
-        "commercial_handover_date": {},
-        "delivery_date": {},
-        "commercial_doc_revd_date": {},
-        "docs_state": {},
-        "invoice_status": {"fields": {"display_name": {}}},
-        "oa_state": {},
-        "partner_id": {"fields": {"display_name": {}}},
-        "payment_maturity_date": {},
-        "payment_maturity_status": {},
-        "payment_recv_date": {},
-        "tentative_acceptance_date": {},
-        "tentative_payment_maturity_date": {},
-        "amount_total": {},
-        "due_amt": {},
-        "total_recv_amt":{}
-    }
+    url = f"{ODOO_URL}/web/dataset/call_kw/combine.invoice/web_search_read"
 
-    while True:
-        payload = {
+    def build_payload(offset, limit, fields, count_limit=None):
+        return {
             "jsonrpc": "2.0",
             "method": "call",
             "params": {
@@ -103,85 +103,123 @@ def fetch_combine_invoice(uid, batch_size=2000):
                 "args": [],
                 "kwargs": {
                     "domain": domain,
-                    "specification": specification,
+                    "specification": fields,
                     "offset": offset,
-                    "limit": batch_size,
-                    "order": "",
+                    "limit": limit,
+                    # A unique sort key keeps offset pages stable between requests
+                    "order": "id",
+                    "count_limit": count_limit,
                     "context": {
                         "lang": "en_US",
                         "tz": "Asia/Dhaka",
                         "uid": uid,
                         "allowed_company_ids": [1, 3, 2, 4],
-                        "bin_size": True,
                         "current_company_id": 1,
                     },
-                    "count_limit": 100000,
                 },
             },
             "id": 2,
         }
 
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/combine.invoice/web_search_read",
-                            data=json.dumps(payload))
+    def fetch_count():
+        resp = session.post(url, data=orjson.dumps(build_payload(0, 1, {"id": {}})))
         resp.raise_for_status()
-        result = resp.json()["result"]
-        records = result.get("records", [])
-        all_records.extend(records)
+        return orjson.loads(resp.content)
+
+    # Read the total up front so every page offset is known and can be fetched in parallel
+    count_data = with_retries(fetch_count)()
+    if "error" in count_data:
+        raise RuntimeError(count_data["error"]["data"]["message"])
+    total_count = count_data["result"]["length"]
+    print(f"🔎 Total records to fetch: {total_count}")
 
-        print(f"Fetched {len(records)} records, total: {len(all_records)}")
-        if len(records) < batch_size:
-            break
-        offset += batch_size
+    def fetch_page(offset):
+        # The total is already known; count_limit=1 stops Odoo re-counting the domain for every full page
+        payload = build_payload(offset, batch_size, SUMMARY_SPECIFICATION, count_limit=1)
+        with session.post(url, data=orjson.dumps(payload), stream=True, timeout=PAGE_TIMEOUT) as resp:
+            resp.raise_for_status()
+            return list(iter_rpc_records(resp))
 
-    print(f"✅ Done. Total fetched: {len(all_records)}")
-    return all_records
+    seen_ids = set()
+    for records in fetch_pages_in_order(with_retries(fetch_page), range(0, total_count, batch_size), max_workers):
+        total += len(records)
+        print(f"Fetched {len(records)} records, total: {total}/{total_count}")
+        # Offset pages can overlap when rows are added mid-fetch; keep the first copy of each id
+        yield from (r for r in records if r["id"] not in seen_ids and not seen_ids.add(r["id"]))
+
+    print(f"✅ Done. Total fetched: {total}")
 
 
 # --------- Flatten Records ---------
+# Sheet column -> Odoo field. The amount columns are copied as numbers.
+SUMMARY_COLUMNS = [
+    ("Number", "name"),
+    ("Partner", "partner_id"),
+    ("Delivery Date", "delivery_date"),
+    ("Doc Received Date", "commercial_doc_revd_date"),
+    ("Handover Date", "commercial_handover_date"),
+    ("Bank Submission Date", "finance_team_submitted_date"),
+    ("Acceptance Status", "acceptance_status"),
+    ("Acceptance Date", "acceptance_date"),
+    ("Tentative Acceptance Date", "tentative_acceptance_date"),
+    ("Payment Maturity Status", "payment_maturity_status"),
+    ("Payment Maturity Date", "payment_maturity_date"),
+    ("Tentative Payment Maturity Date", "tentative_payment_maturity_date"),
+    ("Payment Received Date", "payment_recv_date"),
+    ("OA State", "oa_state"),
+    ("Invoice Status", "invoice_status"),
+    ("Document State", "docs_state"),
+    ("Total Value", "amount_total"),
+    ("Due Amount", "due_amt"),
+    ("total_recv_amt", "total_recv_amt"),
+]
+NUMERIC_COLUMNS = {"Total Value", "Due Amount", "total_recv_amt"}
+
+
 def flatten_invoice_summary(records):
-    return [{
-        "Number": get_string_value(r.get("name")),
-        "Partner": get_string_value(r.get("partner_id")),
-        "Delivery Date": get_string_value(r.get("delivery_date")),
-        "Doc Received Date": get_string_value(r.get("commercial_doc_revd_date")),
-        "Handover Date": get_string_value(r.get("commercial_handover_date")),
-        "Bank Submission Date": get_string_value(r.get("finance_team_submitted_date")),
-        "Acceptance Status": get_string_value(r.get("acceptance_status")),
-        "Acceptance Date": get_string_value(r.get("acceptance_date")),
-        "Tentative Acceptance Date": get_string_value(r.get("tentative_acceptance_date")),
-        "Payment Maturity Status": get_string_value(r.get("payment_maturity_status")),
-        "Payment Maturity Date": get_string_value(r.get("payment_maturity_date")),
-        "Tentative Payment Maturity Date": get_string_value(r.get("tentative_payment_maturity_date")),
-        "Payment Received Date": get_string_value(r.get("payment_recv_date")),
-        "OA State": get_string_value(r.get("oa_state")),
-        "Invoice Status": get_string_value(r.get("invoice_status")),
-        "Document State": get_string_value(r.get("docs_state")),
-        "Total Value": r.get("amount_total", 0),
-        "Due Amount": r.get("due_amt", 0),
-        "total_recv_amt":r.get("total_recv_amt", 0)
-    } for r in records]
+    """Build the sheet frame column by column from the raw Odoo records."""
+    src = pd.DataFrame.from_records(records, columns=[field for _, field in SUMMARY_COLUMNS])
+    flat = pd.DataFrame(index=src.index)
+    for name, field in SUMMARY_COLUMNS:
+        if name in NUMERIC_COLUMNS:
+            flat[name] = src[field].fillna(0)
+        else:
+            flat[name] = src[field].map(compile_extractor(SUMMARY_SPECIFICATION[field]))
+    return flat
 
 
 # --------- Normalize Dates ---------
 def normalize_dates(df: pd.DataFrame):
     date_cols = [c for c in df.columns if "Date" in c]
+    # Odoo sends ISO dates and datetimes; naming the format skips per-column format guessing.
+    # Formatting straight back to YYYY-MM-DD text avoids boxing every cell as a datetime.date
     for col in date_cols:
-        df[col] = pd.to_datetime(df[col], errors="coerce").dt.date
+        df[col] = pd.to_datetime(df[col], errors="coerce", format="ISO8601").dt.strftime("%Y-%m-%d")
     return df
 
 
 # --------- Paste to Google Sheet ---------
 def paste_to_gsheet(df):
-    worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_TAB_NAME)
+    worksheet = get_worksheet(GOOGLE_SHEET_ID, SHEET_TAB_NAME)
     if df.empty:
         print(f"⚠️ Skip: {SHEET_TAB_NAME} DataFrame is empty.")
         return
     worksheet.batch_clear(["A:S"])
-    set_with_dataframe(worksheet, df, include_index=False, include_column_header=True)
+    values = dataframe_values(df)
+    if worksheet.row_count < len(values):
+        worksheet.add_rows(len(values) - worksheet.row_count)
 
     local_tz = pytz.timezone("Asia/Dhaka")
     local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-    worksheet.update("T1", [[f"Last Updated: {local_time}"]])
+    # Rows and timestamp go out together in a single values.batchUpdate request
+    end_cell = gspread.utils.rowcol_to_a1(len(values), len(df.columns))
+    worksheet.batch_update(
+        [
+            {"range": f"A1:{end_cell}", "values": values},
+            {"range": "T1", "values": [[f"Last Updated: {local_time}"]]},
+        ],
+        value_input_option="USER_ENTERED",
+    )
     print(f"✅ Data pasted to Google Sheet ({SHEET_TAB_NAME}), timestamp: {local_time}")
 
 
@@ -189,7 +227,6 @@ def paste_to_gsheet(df):
 if __name__ == "__main__":
     uid = odoo_login()
     records = fetch_combine_invoice(uid)
-    flat_rows = flatten_invoice_summary(records)
-    df = pd.DataFrame(flat_rows)
+    df = flatten_invoice_summary(records)
     df = normalize_dates(df)
     paste_to_gsheet(df)
\ No newline at end of file
@@ -1,33 +1,26 @@
 # sync_odoo_to_gsheets.py
 import os
-import json
-import base64
+import orjson
 import requests
 import pandas as pd
 import gspread
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
 from datetime import datetime
+from itertools import islice
 import pytz
+from gsheets import dataframe_values, get_worksheet
+from odoo import compile_extractor, fetch_pages_in_order, with_retries
 
 # --------- Config from Environment ---------
 ODOO_URL = os.getenv("ODOO_URL")
 ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("ODOO_USERNAME")
 ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
-GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "1V0x5_DJn6bC1xzyMeBglzSeH-eDIWtKG4E5Cv3rwA_I")
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+FETCH_WORKERS = 8  # concurrent Odoo page requests
 
 session = requests.Session()
-session.headers.update({"Content-Type": "application/json"})
+session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip"})
 
 
 # --------- Login ---------
@@ -39,121 +32,72 @@ def odoo_login():
         "params": {"db": ODOO_DB, "login": ODOO_USERNAME, "password": ODOO_PASSWORD},
         "id": 3,
     }
-    resp = session.post(url, data=json.dumps(payload))
+    resp = session.post(url, data=orjson.dumps(payload))
     resp.raise_for_status()
-    uid = resp.json()["result"]["uid"]
+    uid = orjson.loads(resp.content)["result"]["uid"]
     print(f"✅ Logged in! UID: {uid}")
     return uid
 
 
-# --------- Helper to safely get string values ---------
-def get_string_value(field, subfield=None):
-    """
-    Safely extract a string from Odoo API fields.
-    Handles:
-      - dict with display_name or nested fields
-      - int (ID)
-      - str
-      - False/None
-    """
-    if isinstance(field, dict):
-        if subfield:
-            value = field.get(subfield)
-            return get_string_value(value)
-        if "display_name" in field:
-            return str(field["display_name"] or "")
-        # fallback: join all dict values as string
-        return " ".join([str(v) for v in field.values()])
-    elif isinstance(field, int):
-        return str(field)
-    elif field in (False, None):
-        return ""
-    return str(field)
-
-
 # --------- Fetch All Sale Orders for a Company ---------
-def fetch_sale_orders_for_company(uid, company_id, batch_size=2000):
-    all_records = []
-    offset = 0
-
-    domain = ["&", ["sales_type", "=", "oa"], ["state", "=", "sale"]]
-    specification = {
-        "order_line": {
-            "fields": {
-                "order_id": {
-                    "fields": {
-                        "name": {},
-                        "order_ref": {"fields": {"display_name": {}}},
-                        "buyer_name": {
-                            "fields": {
-                                "display_name": {},
-                                "brand": {"fields": {"display_name": {}}},
-                            }
-                        },
-                        "buying_house": {"fields": {"display_name": {}}},
-                        "company_id": {"fields": {"display_name": {}}},
-                        "partner_id": {
-                            "fields": {
-                                "display_name": {},
-                                "group": {"fields": {"display_name": {}}},
-                            }
-                        },
-                        "date_order": {},
-                        "team_id": {"fields": {"display_name": {}}},
-                        "user_id": {"fields": {"display_name": {}}},
-                        "lc_number": {},
-                        "payment_term_id": {"fields": {"display_name": {}}},
-                        "state": {},
-                    }
-                },
-                "product_template_id": {
-                    "fields": {
-                        "fg_categ_type": {"fields": {"display_name": {}}},
-                    }
-                },
-                "product_uom_qty": {},
-                "price_total": {},
-                "slidercodesfg": {},
-            }
+SALE_ORDER_SPECIFICATION = {
+    "order_line": {
+        "fields": {
+            "order_id": {
+                "fields": {
+                    "name": {},
+                    "order_ref": {"fields": {"display_name": {}}},
+                    "buyer_name": {
+                        "fields": {
+                            "display_name": {},
+                            "brand": {"fields": {"display_name": {}}},
+                        }
+                    },
+                    "buying_house": {"fields": {"display_name": {}}},
+                    "company_id": {"fields": {"display_name": {}}},
+                    "partner_id": {
+                        "fields": {
+                            "display_name": {},
+                            "group": {"fields": {"display_name": {}}},
+                        }
+                    },
+                    "date_order": {},
+                    "team_id": {"fields": {"display_name": {}}},
+                    "user_id": {"fields": {"display_name": {}}},
+                    "lc_number": {},
+                    "payment_term_id": {"fields": {"display_name": {}}},
+                    "state": {},
+                }
+            },
+            "product_template_id": {
+                "fields": {
+                    "fg_categ_type": {"fields": {"display_name": {}}},
+                }
+            },
+            "product_uom_qty": {},
+            "price_total": {},
+            "slidercodesfg": {},
         }
     }
+}
+
+
+def fetch_sale_orders_for_company(uid, company_id, batch_size=2000, max_workers=FETCH_WORKERS):
+    total = 0
 
+    domain = ["&", ["sales_type", "=", "oa"], ["state", "=", "sale"]]
     context = {
         "lang": "en_US",
         "tz": "Asia/Dhaka",
         "uid": uid,
         "allowed_company_ids": [company_id],
-        "bin_size": True,
         "current_company_id": company_id,
     }
 
-    # Optional: get total count
-    count_payload = {
-        "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": "sale.order",
-            "method": "web_search_read",
-            "args": [],
-            "kwargs": {
-                "domain": domain,
-                "specification": {"id": {}},
-                "limit": 1,
-                "context": context,
-            },
-        },
-        "id": 99,
-    }
-    count_resp = session.post(
-        f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read",
-        data=json.dumps(count_payload),
-    )
-    count_resp.raise_for_status()
-    total_count = count_resp.json()["result"]["length"]
-    print(f"🔎 Total records to fetch for company {company_id}: {total_count}")
+    url = f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read"
 
-    while True:
-        payload = {
+    def build_payload(offset, limit, fields, count_limit=None):
+        return {
             "jsonrpc": "2.0",
             "method": "call",
             "params": {
@@ -162,68 +106,110 @@ def fetch_sale_orders_for_company(uid, company_id, batch_size=2000):
                 "args": [],
                 "kwargs": {
                     "domain": domain,
-                    "specification": specification,
+                    "specification": fields,
                     "offset": offset,
-                    "limit": batch_size,
-                    "order": "",
+                    "limit": limit,
+                    # A unique sort key keeps offset pages stable between requests
+                    "order": "id",
+                    "count_limit": count_limit,
                     "context": context,
-                    "count_limit": 100000,
                 },
             },
             "id": 3,
         }
-        resp = session.post(
-            f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read",
-            data=json.dumps(payload),
-        )
+
+    def fetch_count():
+        resp = session.post(url, data=orjson.dumps(build_payload(0, 1, {"id": {}})))
         resp.raise_for_status()
-        result = resp.json()["result"]
-        records = result.get("records", [])
-        all_records.extend(records)
+        return orjson.loads(resp.content)
+
+    # Read the total up front so every page offset is known and can be fetched in parallel
+    total_count = with_retries(fetch_count)()["result"]["length"]
+    print(f"🔎 Total records to fetch for company {company_id}: {total_count}")
+
+    def fetch_page(offset):
+        # The total is already known; count_limit=1 stops Odoo re-counting the domain for every full page
+        payload = build_payload(offset, batch_size, SALE_ORDER_SPECIFICATION, count_limit=1)
+        resp = session.post(url, data=orjson.dumps(payload))
+        resp.raise_for_status()
+        return orjson.loads(resp.content)["result"].get("records", [])
+
+    offsets = range(0, total_count, batch_size)
+    seen_ids = set()
+    for records in fetch_pages_in_order(with_retries(fetch_page), offsets, max_workers):
+        total += len(records)
         print(
-            f"Fetched {len(records)} records for company {company_id}, total so far: {len(all_records)}/{total_count}"
+            f"Fetched {len(records)} records for company {company_id}, total so far: {total}/{total_count}"
         )
-        if len(records) < batch_size:
-            break
-        offset += batch_size
+        # Offset pages can overlap when rows are added mid-fetch; keep the first copy of each id
+        yield from (r for r in records if r["id"] not in seen_ids and not seen_ids.add(r["id"]))
 
-    print(f"✅ Finished fetching for company {company_id}. Total fetched: {len(all_records)}")
-    return all_records
+    print(f"✅ Finished fetching for company {company_id}. Total fetched: {total}")
 
 
 # --------- Flatten Records into Rows ---------
-def flatten_records(records):
-    flat_rows = []
-    for record in records:
-        order_lines = record.get("order_line", [])
-        for line in order_lines:
-            order_id = line.get("order_id", {}) or {}
-            flat_rows.append({
-                "Order Reference": get_string_value(order_id.get("name")),
-                "Sales Order Ref.": get_string_value(order_id.get("order_ref")),
-                "Buyer": get_string_value(order_id.get("buyer_name")),
-                "Brand Group": get_string_value(order_id.get("buyer_name"), "brand"),
-                "Buying House": get_string_value(order_id.get("buying_house")),
-                "Company": get_string_value(order_id.get("company_id")),
-                "Customer": get_string_value(order_id.get("partner_id")),
-                "Customer Group": get_string_value(order_id.get("partner_id"), "group"),
-                "Order Date": get_string_value(order_id.get("date_order")),
-                "Sales Team": get_string_value(order_id.get("team_id")),
-                "Salesperson": get_string_value(order_id.get("user_id")),
-                "FG Category": get_string_value(line.get("product_template_id"), "fg_categ_type"),
-                "Quantity": line.get("product_uom_qty", 0),
-                "Total": line.get("price_total", 0),
-                "Slider Code (SFG)": get_string_value(line.get("slidercodesfg")),
-                "LC Number": get_string_value(order_id.get("lc_number")),
-                "Payment Terms": get_string_value(order_id.get("payment_term_id")),
-                "Status": get_string_value(order_id.get("state")),
-            })
-    return flat_rows
+# Sheet column -> (source, Odoo field, subfield); the source is either the
+# order line itself or the sale order it belongs to (its order_id).
+ORDER_LINE_COLUMNS = [
+    ("Order Reference", "order", "name", None),
+    ("Sales Order Ref.", "order", "order_ref", None),
+    ("Buyer", "order", "buyer_name", None),
+    ("Brand Group", "order", "buyer_name", "brand"),
+    ("Buying House", "order", "buying_house", None),
+    ("Company", "order", "company_id", None),
+    ("Customer", "order", "partner_id", None),
+    ("Customer Group", "order", "partner_id", "group"),
+    ("Order Date", "order", "date_order", None),
+    ("Sales Team", "order", "team_id", None),
+    ("Salesperson", "order", "user_id", None),
+    ("FG Category", "line", "product_template_id", "fg_categ_type"),
+    ("Quantity", "line", "product_uom_qty", None),
+    ("Total", "line", "price_total", None),
+    ("Slider Code (SFG)", "line", "slidercodesfg", None),
+    ("LC Number", "order", "lc_number", None),
+    ("Payment Terms", "order", "payment_term_id", None),
+    ("Status", "order", "state", None),
+]
+NUMERIC_COLUMNS = {"Quantity", "Total"}
+LINE_SPECIFICATION = SALE_ORDER_SPECIFICATION["order_line"]["fields"]
+SOURCE_SPECIFICATIONS = {"line": LINE_SPECIFICATION, "order": LINE_SPECIFICATION["order_id"]["fields"]}
+
+
+def flatten_records(records, chunk_size=2000):
+    """
+    Build the order line frame from the (streamed) sale order records a chunk of
+    orders at a time, so only one chunk's raw dicts are held next to the frames
+    already built.
+    """
+    records = iter(records)
+    frames = [flatten_chunk(chunk) for chunk in iter(lambda: list(islice(records, chunk_size)), [])]
+    return pd.concat(frames, ignore_index=True) if frames else flatten_chunk([])
+
+
+def flatten_chunk(records):
+    """Build the order line frame column by column from a list of raw sale order records."""
+    lines = [line for record in records for line in record.get("order_line", [])]
+    fields = {source: list(dict.fromkeys(f for _, src, f, _ in ORDER_LINE_COLUMNS if src == source))
+              for source in ("line", "order")}
+    sources = {
+        "line": pd.DataFrame.from_records(lines, columns=fields["line"]),
+        "order": pd.DataFrame.from_records([line.get("order_id") or {} for line in lines], columns=fields["order"]),
+    }
+    flat = pd.DataFrame(index=range(len(lines)))
+    for name, source, field, subfield in ORDER_LINE_COLUMNS:
+        col = sources[source][field]
+        if name in NUMERIC_COLUMNS:
+            flat[name] = col.fillna(0)
+        else:
+            # Missing fields come through as NaN and read as empty, like a missing key did
+            extract = compile_extractor(SOURCE_SPECIFICATIONS[source][field], subfield)
+            flat[name] = col.map(extract, na_action="ignore").fillna("")
+    return flat
 
 
 def paste_to_gsheet(df, sheet_name):
     try:
-        worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
+        worksheet = get_worksheet(GOOGLE_SHEET_ID, sheet_name)
         
         if df.empty:
             print(f"⚠️ Skip: {sheet_name} is empty")
@@ -232,12 +218,20 @@ def paste_to_gsheet(df, sheet_name):
         # Clear range A:R (assuming up to 18 columns)
         worksheet.batch_clear(["A:R"])
 
-        # Paste the dataframe starting from A1
-        set_with_dataframe(worksheet, df, include_index=False, include_column_header=True)
+        values = dataframe_values(df)
+        if worksheet.row_count < len(values):
+            worksheet.add_rows(len(values) - worksheet.row_count)
 
-        # Add timestamp to S1
+        # Paste the dataframe from A1 and the timestamp to S1 in a single request
         local_time = datetime.now(pytz.timezone("Asia/Dhaka")).strftime("%Y-%m-%d %H:%M:%S")
-        worksheet.update("S1", [[f"Last Updated: {local_time}"]])
+        end_cell = gspread.utils.rowcol_to_a1(len(values), len(df.columns))
+        worksheet.batch_update(
+            [
+                {"range": f"A1:{end_cell}", "values": values},
+                {"range": "S1", "values": [[f"Last Updated: {local_time}"]]},
+            ],
+            value_input_option="USER_ENTERED",
+        )
 
         print(f"✅ Data pasted to {sheet_name} and timestamp updated in S1")
     except Exception as e:
@@ -260,24 +254,22 @@ if __name__ == "__main__":
         while retries < MAX_RETRIES:
             try:
                 records = fetch_sale_orders_for_company(uid, company_id)
-                flat_rows = flatten_records(records)
-                df = pd.DataFrame(flat_rows)
+                df = flatten_records(records)
 
                 if df.empty:
                     print(f"⚠️ No data for Company {company_id}")
                     break
 
-                # Automatically find numeric columns for aggregation
-                numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
-
-                # Automatically find non-numeric columns for group by
-                group_cols = [col for col in df.columns if col not in numeric_cols]
+                # Columns are strings or numbers by construction, so split on the known schema
+                numeric_cols = [col for col in df.columns if col in NUMERIC_COLUMNS]
+                group_cols = [col for col in df.columns if col not in NUMERIC_COLUMNS]
 
                 # Create aggregation dictionary dynamically (sum for numbers)
                 agg_dict = {col: "sum" for col in numeric_cols}
 
-                # Group by ALL non-numeric columns
-                df_grouped = df.groupby(group_cols, as_index=False).agg(agg_dict).round(2)
+                # Group by ALL non-numeric columns, as category so the keys hash as integer codes
+                df[group_cols] = df[group_cols].astype("category")
+                df_grouped = df.groupby(group_cols, as_index=False, observed=True).agg(agg_dict).round(2)
 
                 paste_to_gsheet(df_grouped, sheet_tab)
                 print(f"✅ Finished processing Company {company_id}")
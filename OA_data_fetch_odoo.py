@@ -1,11 +1,9 @@
 import os
 import json
-import base64
 import requests
 import pandas as pd
 import gspread
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
+from gsheets import dataframe_values, get_worksheet
 from datetime import datetime
 import pytz
 
@@ -14,17 +12,8 @@ ODOO_URL = os.getenv("ODOO_URL")
 ODOO_DB = os.getenv("ODOO_DB")
 ODOO_USERNAME = os.getenv("ODOO_USERNAME")
 ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
-GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1V0x5_DJn6bC1xzyMeBglzSeH-eDIWtKG4E5Cv3rwA_I"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
-
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
 
@@ -47,7 +36,7 @@ def odoo_login():
 
 # --------- Fetch Data ---------
 def fetch_all_data(uid, company_id, batch_size=1000):
-    all_records, offset = [], 0
+    fetched, offset = 0, 0
     domain = ["&", ["sales_type", "=", "oa"], ["state", "=", "sale"]]
     specification = {
         "amount_invoiced": {},
@@ -81,7 +70,6 @@ def fetch_all_data(uid, company_id, batch_size=1000):
                         "tz": "Asia/Dhaka",
                         "uid": uid,
                         "allowed_company_ids": [company_id],
-                        "bin_size": True,
                         "current_company_id": company_id
                     },
                     "count_limit": 10001
@@ -93,14 +81,15 @@ def fetch_all_data(uid, company_id, batch_size=1000):
         resp.raise_for_status()
         result = resp.json()['result']
         records = result['records']
-        all_records.extend(records)
-        print(f"[Company {company_id}] Fetched {len(records)} records, total so far: {len(all_records)}")
+        fetched += len(records)
+        print(f"[Company {company_id}] Fetched {len(records)} records, total so far: {fetched}")
+        # Hand each page on as it arrives rather than collecting every page first
+        yield from records
         if len(records) < batch_size:
             break
         offset += batch_size
 
-    print(f"✅ Company {company_id} total records fetched: {len(all_records)}")
-    return all_records
+    print(f"✅ Company {company_id} total records fetched: {fetched}")
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -128,7 +117,7 @@ def flatten_record(rec):
     
     
 def paste_to_gsheet(df, sheet_name):
-    worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
+    worksheet = get_worksheet(GOOGLE_SHEET_ID, sheet_name)
     if df.empty:
         print(f"Skip: {sheet_name} DataFrame is empty, not pasting.")
         return
@@ -136,15 +125,23 @@ def paste_to_gsheet(df, sheet_name):
     # Clear only the range A:N
     worksheet.batch_clear(["A:N"])
 
-    # Paste the dataframe
-    set_with_dataframe(worksheet, df)
-
-    print(f"✅ Data pasted to Google Sheet ({sheet_name}).")
+    values = dataframe_values(df)
+    if worksheet.row_count < len(values):
+        worksheet.add_rows(len(values) - worksheet.row_count)
 
-    # Add timestamp to N1 using named arguments (new gspread)
+    # Paste the dataframe from A1 and the timestamp to N1 in a single values.batchUpdate
     local_tz = pytz.timezone("Asia/Dhaka")
     local_time = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-    worksheet.update(range_name="N1", values=[[local_time]])
+    end_cell = gspread.utils.rowcol_to_a1(len(values), len(df.columns))
+    worksheet.batch_update(
+        [
+            {"range": f"A1:{end_cell}", "values": values},
+            {"range": "N1", "values": [[local_time]]},
+        ],
+        value_input_option="USER_ENTERED",
+    )
+
+    print(f"✅ Data pasted to Google Sheet ({sheet_name}).")
     print(f"Timestamp written to N1: {local_time}")
 
 # --------- Main ---------
@@ -0,0 +1,63 @@
+"""
+Google Sheets access shared by the fetch scripts: one authorized gspread
+client per process, reusable worksheet handles, and DataFrame -> cell values.
+
+Credentials come from GOOGLE_CREDENTIALS_BASE64 (base64 of the service
+account JSON; the plain JSON is accepted too).
+"""
+import base64
+import json
+import os
+import time
+from functools import lru_cache
+
+import gspread
+import pandas as pd
+from google.oauth2.service_account import Credentials
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+WORKSHEET_TTL = 3600  # seconds an opened worksheet handle is reused
+_worksheets = {}
+
+
+# --------- Client ---------
+def load_service_account_info(raw):
+    """Service account info from the env value, whether base64-encoded or plain JSON."""
+    try:
+        return json.loads(base64.b64decode(raw.strip()))
+    except ValueError:
+        return json.loads(raw)
+
+
+@lru_cache(maxsize=1)
+def get_gc():
+    """Authorize gspread once per process; later calls reuse the same client."""
+    creds_json = load_service_account_info(os.getenv("GOOGLE_CREDENTIALS_BASE64"))
+    creds = Credentials.from_service_account_info(creds_json, scopes=SCOPES)
+    return gspread.authorize(creds)
+
+
+def get_worksheet(sheet_id, tab_name):
+    """Open a worksheet, reusing the handle if it was opened within WORKSHEET_TTL."""
+    cached = _worksheets.get((sheet_id, tab_name))
+    if cached and time.monotonic() - cached["timestamp"] < WORKSHEET_TTL:
+        return cached["worksheet"]
+    worksheet = get_gc().open_by_key(sheet_id).worksheet(tab_name)
+    _worksheets[(sheet_id, tab_name)] = {"worksheet": worksheet, "timestamp": time.monotonic()}
+    return worksheet
+
+
+# --------- Values ---------
+def sheet_text(value):
+    """``value`` as text cell input; Sheets reads a leading apostrophe as a text marker, so it is doubled to keep it."""
+    text = str(value)
+    return "'" + text if text.startswith("'") else text
+
+
+def dataframe_values(df):
+    """Header plus rows as sheet cell values: blanks for missing, numbers as-is, anything else as text."""
+    body = df.astype(object).where(df.notna(), "")
+    for col in body.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            body[col] = body[col].map(sheet_text)
+    return [df.columns.tolist()] + body.values.tolist()
@@ -15,16 +15,14 @@ Optional:
 """
 import os
 import json
-import base64
 import requests
-import pandas as pd
 from datetime import datetime, time
 import pytz
 import traceback
 from dotenv import load_dotenv
 import gspread
-from google.oauth2.service_account import Credentials
-from gspread_dataframe import set_with_dataframe
+from gsheets import get_gc, sheet_text
+from odoo import fetch_pages_in_order
 load_dotenv()
 # ---------- Config ----------
 GOOGLE_SHEET_ID_FALLBACK = "1l2xcuZVCgj3yVVKerFE9iCIK1SvyHUMWpZQ5af5wbLM"
@@ -47,24 +45,11 @@ missing = [k for k, v in required.items() if not v]
 if missing:
     raise SystemExit(f"Missing environment variables: {missing}")
 
-# ---------- Google client ----------
-creds_b64 = GOOGLE_CREDENTIALS_BASE64.strip()
-try:
-    creds_raw = base64.b64decode(creds_b64)
-    creds_json = json.loads(creds_raw)
-except Exception:
-    try:
-        creds_json = json.loads(GOOGLE_CREDENTIALS_BASE64)
-    except Exception as e:
-        raise RuntimeError("Failed to decode GOOGLE_CREDENTIALS_BASE64: " + str(e))
-
-scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-google_creds = Credentials.from_service_account_info(creds_json, scopes=scopes)
-gc = gspread.authorize(google_creds)
-
 # ---------- HTTP session ----------
+FETCH_WORKERS = 8  # concurrent Odoo page requests
+
 session = requests.Session()
-session.headers.update({"Content-Type": "application/json"})
+session.headers.update({"Content-Type": "application/json", "Accept-Encoding": "gzip"})
 
 # ---------- Helpers ----------
 def odoo_authenticate():
@@ -103,19 +88,28 @@ def safe_display_name(obj):
         return obj.get("display_name", "")
     return ""
 
+SHEET_COLUMNS = [
+    "Already invoiced", "Buyer", "Customer", "Order Reference",
+    "Sales Order Ref.", "Salesperson", "PI Date", "Order Date",
+    "Total", "Total PI Quantity"
+]
+
 def flatten_sale_record(rec):
-    return {
-        "Already invoiced": rec.get("amount_invoiced", ""),
-        "Buyer": rec.get("buyer_name", ""),
-        "Customer": safe_display_name(rec.get("partner_id")),
-        "Order Reference": rec.get("name", ""),
-        "Sales Order Ref.": safe_display_name(rec.get("order_ref")),
-        "Salesperson": safe_display_name(rec.get("user_id")),
-        "PI Date": rec.get("pi_date", ""),
-        "Order Date": rec.get("date_order", ""),
-        "Total": rec.get("amount_total", ""),
-        "Total PI Quantity": rec.get("total_product_qty", "")
-    }
+    """One sheet row in SHEET_COLUMNS order; missing values become blanks."""
+    row = [
+        rec.get("amount_invoiced", ""),
+        rec.get("buyer_name", ""),
+        safe_display_name(rec.get("partner_id")),
+        rec.get("name", ""),
+        safe_display_name(rec.get("order_ref")),
+        safe_display_name(rec.get("user_id")),
+        rec.get("pi_date", ""),
+        rec.get("date_order", ""),
+        rec.get("amount_total", ""),
+        rec.get("total_product_qty", "")
+    ]
+    # Text goes through the same apostrophe escaping as gsheets.dataframe_values
+    return ["" if v is None else sheet_text(v) if isinstance(v, str) else v for v in row]
 
 def get_date_range_strings():
     start_str = "2025-05-01 05:07:48"
@@ -143,10 +137,9 @@ def build_odoo_domain(start_str, end_str, team_list):
     ]
 
 # ---------- Fetching (paginated) ----------
-def fetch_sale_orders(uid, company_id, team_list=[17, 16], batch_size=1000):
+def fetch_sale_orders(uid, company_id, team_list=[17, 16], batch_size=1000, max_workers=FETCH_WORKERS):
     endpoint = f"{ODOO_URL.rstrip('/')}/web/dataset/call_kw/sale.order/web_search_read"
-    offset = 0
-    all_records = []
+    fetched = 0
 
     start_str, end_str = get_date_range_strings()
     domain = build_odoo_domain(start_str, end_str, team_list)
@@ -154,8 +147,8 @@ def fetch_sale_orders(uid, company_id, team_list=[17, 16], batch_size=1000):
     print("DEBUG: Using domain:")
     print(json.dumps(domain, indent=2))
 
-    while True:
-        payload = {
+    def build_payload(offset, limit, specification, count_limit=None):
+        return {
             "jsonrpc": "2.0",
             "method": "call",
             "params": {
@@ -163,60 +156,77 @@ def fetch_sale_orders(uid, company_id, team_list=[17, 16], batch_size=1000):
                 "method": "web_search_read",
                 "args": [],
                 "kwargs": {
-                    "specification": SPECIFICATION,
+                    "specification": specification,
                     "domain": domain,
                     "offset": offset,
-                    "limit": batch_size,
-                    "order": "",
+                    "limit": limit,
+                    # A unique sort key keeps offset pages stable between requests
+                    "order": "id",
+                    "count_limit": count_limit,
                     "context": {
                         "lang": "en_US",
                         "tz": "Asia/Dhaka",
                         "uid": uid,
                         "allowed_company_ids": [company_id],
-                        "bin_size": True,
                         "current_company_id": company_id
-                    },
-                    "count_limit": 10001
+                    }
                 }
             },
             "id": 200 + offset
         }
+
+    def call(payload):
         try:
             resp = session.post(endpoint, json=payload, timeout=60)
             resp.raise_for_status()
-            body = resp.json()
+            return resp.json().get("result", {})
         except Exception as e:
             print("Error calling web_search_read:", e)
             traceback.print_exc()
             raise
 
-        records = body.get("result", {}).get("records", [])
-        fetched = len(records)
-        print(f"[company {company_id}] fetched {fetched} rows (offset={offset})")
-        all_records.extend(records)
-        if fetched < batch_size:
-            break
-        offset += batch_size
+    # Read the total first so every page offset is known and pages can be fetched concurrently
+    total = call(build_payload(0, 1, {"id": {}})).get("length", 0)
+    print(f"[company {company_id}] {total} records to fetch")
+
+    def fetch_page(offset):
+        # The total is already known; count_limit=1 stops Odoo re-counting the domain for every full page
+        return call(build_payload(offset, batch_size, SPECIFICATION, count_limit=1)).get("records", [])
 
-    print(f"[company {company_id}] total records fetched: {len(all_records)} (date_range: {start_str} -> {end_str})")
-    return all_records
+    offsets = range(0, total, batch_size)
+    seen_ids = set()
+    for offset, records in zip(offsets, fetch_pages_in_order(fetch_page, offsets, max_workers)):
+        print(f"[company {company_id}] fetched {len(records)} rows (offset={offset})")
+        fetched += len(records)
+        # Hand each page on as it arrives rather than collecting every page first. Offset pages
+        # can overlap when orders are added mid-fetch; keep the first copy of each id
+        yield from (r for r in records if r["id"] not in seen_ids and not seen_ids.add(r["id"]))
+
+    print(f"[company {company_id}] total records fetched: {fetched} (date_range: {start_str} -> {end_str})")
 
 # ---------- Paste to sheet (A:P) ----------
-def paste_dataframe_to_sheet(df, worksheet_name):
-    sh = gc.open_by_key(GOOGLE_SHEET_ID)
+def paste_rows_to_sheet(rows, worksheet_name):
+    sh = get_gc().open_by_key(GOOGLE_SHEET_ID)
     try:
         ws = sh.worksheet(worksheet_name)
     except gspread.exceptions.WorksheetNotFound:
         ws = sh.add_worksheet(title=worksheet_name, rows="100", cols="20")
     ws.batch_clear(["A:P"])
-    if not df.empty:
-        set_with_dataframe(ws, df)  # writes starting at A1
-        print(f"Pasted {len(df)} rows to '{worksheet_name}'.")
-    else:
-        print(f"No rows to paste for '{worksheet_name}'.")
     tz = pytz.timezone("Asia/Dhaka")
     ts = datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
-    ws.update(range_name="P1", values=[[ts]])
+    # Rows (from A1) and the P1 timestamp go out as one values.batchUpdate request
+    data = [{"range": "P1", "values": [[ts]]}]
+    if rows:
+        values = [SHEET_COLUMNS] + rows
+        if ws.row_count < len(values):
+            ws.add_rows(len(values) - ws.row_count)
+        end_cell = gspread.utils.rowcol_to_a1(len(values), len(SHEET_COLUMNS))
+        data.insert(0, {"range": f"A1:{end_cell}", "values": values})
+    ws.batch_update(data, value_input_option="USER_ENTERED")
+    if rows:
+        print(f"Pasted {len(rows)} rows to '{worksheet_name}'.")
+    else:
+        print(f"No rows to paste for '{worksheet_name}'.")
     print(f"Timestamp written to P1: {ts}")
 
 # ---------- Main ----------
@@ -231,13 +241,8 @@ def main():
     for cid, sheet_name in company_map:
         try:
             records = fetch_sale_orders(uid, cid, team_list=[17, 16], batch_size=500)
-            flat = [flatten_sale_record(r) for r in records]
-            df = pd.DataFrame(flat, columns=[
-                "Already invoiced", "Buyer", "Customer", "Order Reference",
-                "Sales Order Ref.", "Salesperson", "PI Date", "Order Date",
-                "Total", "Total PI Quantity"
-            ])
-            paste_dataframe_to_sheet(df, sheet_name)
+            rows = [flatten_sale_record(r) for r in records]
+            paste_rows_to_sheet(rows, sheet_name)
         except Exception as e:
             print(f"Failed for company {cid} -> sheet {sheet_name}: {e}")
             traceback.print_exc()
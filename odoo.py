@@ -0,0 +1,170 @@
+"""
+Odoo JSON-RPC plumbing shared by the fetch scripts: cached login sessions,
+string extractors for web_search_read values, streamed parsing of large record
+responses and bounded parallel page fetching with retries.
+"""
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from itertools import islice
+
+import ijson
+import orjson
+import requests
+import urllib3
+
+ODOO_SESSION_CACHE_DIR = os.getenv("ODOO_SESSION_CACHE_DIR", tempfile.gettempdir())
+# (connect, read) seconds for a page request; the read budget applies between
+# received chunks, so a stalled stream fails instead of hanging the run
+PAGE_TIMEOUT = (10, 120)
+# A streamed page is parsed straight off the socket, so a dropped connection or a
+# truncated body surfaces as a urllib3 or ijson error rather than a requests one
+RETRYABLE_ERRORS = (requests.RequestException, urllib3.exceptions.HTTPError, ijson.JSONError)
+
+
+# --------- Cached Odoo session ---------
+def session_cache_path(name):
+    """Cache file for one script's session; scripts run side by side, so each keeps its own."""
+    return os.path.join(ODOO_SESSION_CACHE_DIR, f"odoo_session_{name}.json")
+
+
+def save_session(session, path, owner, **extra):
+    """
+    Persist the session cookie, plus any ``extra`` values, so the next run can
+    skip authentication. The data goes to a temp file beside ``path`` that is
+    then renamed over it, so a reader never sees a half-written cache.
+    """
+    data = {"owner": owner, "cookies": requests.utils.dict_from_cookiejar(session.cookies), **extra}
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(path), prefix=".odoo_session_", delete=False) as f:
+            tmp_path = f.name
+            f.write(orjson.dumps(data))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"⚠️ Could not cache Odoo session: {e}")
+        if tmp_path:
+            with suppress(OSError):
+                os.remove(tmp_path)
+
+
+def drop_session(path):
+    """Forget a cached session, e.g. when Odoo rejected something stored with it."""
+    with suppress(OSError):
+        os.remove(path)
+
+
+def restore_session(session, url, path, owner):
+    """
+    Load the cached session cookie into ``session``. Returns the cached data,
+    with the session's ``uid`` added, if Odoo still accepts it, else None.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    if data.get("owner") != owner:
+        return None
+
+    session.cookies.update(data.get("cookies", {}))
+    payload = {"jsonrpc": "2.0", "method": "call", "params": {}, "id": 1}
+    try:
+        resp = session.post(
+            f"{url}/web/session/get_session_info",
+            data=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        )
+        resp.raise_for_status()
+        info = orjson.loads(resp.content).get("result") or {}
+    except (requests.RequestException, orjson.JSONDecodeError):
+        info = {}
+    if not info.get("uid"):
+        session.cookies.clear()
+        return None
+    data["uid"] = info["uid"]
+    return data
+
+
+# --------- Extract string values ---------
+def get_display_name(field):
+    """String value of a relation read as {"display_name": ...}; False when unset."""
+    return str(field["display_name"] or "") if field else ""
+
+
+def get_scalar_value(field):
+    """String value of a plain field; Odoo sends False for an empty one."""
+    return "" if field is False or field is None else str(field)
+
+
+def compile_extractor(spec, subfield=None):
+    """
+    Pick the string extractor for a field from its read specification, so the
+    value's shape is known up front instead of being type-checked per cell.
+    With ``subfield``, extract that field of the related record instead.
+    """
+    if subfield is not None:
+        extract = compile_extractor(spec["fields"][subfield])
+        return lambda field: extract(field[subfield]) if field else ""
+    if "display_name" in spec.get("fields", {}):
+        return get_display_name
+    return get_scalar_value
+
+
+# --------- Stream records out of a JSON-RPC response ---------
+def _raise_on_rpc_error(events):
+    """Pass ijson events through, raising if the response carries an Odoo error."""
+    error = {}
+    for prefix, event, value in events:
+        if prefix in ("error.message", "error.data.message"):
+            error[prefix] = value
+        elif prefix == "error" and event == "end_map":
+            raise RuntimeError(error.get("error.data.message") or error.get("error.message") or "Odoo RPC error")
+        yield prefix, event, value
+
+
+def iter_rpc_records(resp):
+    """
+    Yield each record of ``result.records`` as it is parsed from the response
+    stream, without buffering the whole payload or building the full result dict.
+    """
+    resp.raw.decode_content = True
+    events = ijson.parse(resp.raw, use_float=True)
+    yield from ijson.items(_raise_on_rpc_error(events), "result.records.item")
+
+
+# --------- Bounded parallel page fetch ---------
+def fetch_pages_in_order(fetch_page, offsets, max_workers):
+    """
+    Yield ``fetch_page(offset)`` results in offset order while keeping at most
+    ``max_workers`` pages in flight, so fetched pages never pile up in memory
+    faster than the caller consumes them.
+    """
+    offsets = iter(offsets)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(executor.submit(fetch_page, offset) for offset in islice(offsets, max_workers))
+        while pending:
+            page = pending.popleft().result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(executor.submit(fetch_page, next_offset))
+            yield page
+
+
+# --------- Retry transient HTTP failures ---------
+def with_retries(fetch, attempts=4, base_delay=1.0):
+    """Wrap ``fetch`` so a failed request is retried with exponential backoff."""
+    def fetch_with_retries(*args):
+        for attempt in range(attempts):
+            try:
+                return fetch(*args)
+            except RETRYABLE_ERRORS as e:
+                if attempt == attempts - 1:
+                    raise
+                delay = base_delay * 2 ** attempt
+                print(f"⚠️ Request failed ({e}), retrying in {delay:.0f}s...")
+                time.sleep(delay)
+    return fetch_with_retries